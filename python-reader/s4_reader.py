@@ -1,103 +1,711 @@
+import bisect
+import logging
 import lzma
+import mmap
+import os
 import sqlite3
-import tempfile
-from typing import Any
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Optional
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
+logger = logging.getLogger(__name__)
 
-@dataclass
+# entries are xz streams by default (what the rust compressor writes), archives re-packed with
+# zstd are detected per entry by the frame magic
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+_zstd_dict_data: Optional[bytes] = None
+# bumped on every dictionary change so per-thread decompressors know to rebuild
+_zstd_dict_version = 0
+# zstandard decompressors must not be shared between threads, keep one per thread
+_zstd_local = threading.local()
+
+
+def set_zstd_dictionary(dict_data: Optional[bytes]):
+    global _zstd_dict_data, _zstd_dict_version
+    _zstd_dict_data = dict_data
+    _zstd_dict_version += 1
+
+
+def _get_zstd_thread_state():
+    if getattr(_zstd_local, "version", None) != _zstd_dict_version:
+        import zstandard
+        dict_data = None
+        if _zstd_dict_data is not None:
+            dict_data = zstandard.ZstdCompressionDict(_zstd_dict_data)
+        _zstd_local.dctx = zstandard.ZstdDecompressor(dict_data=dict_data)
+        _zstd_local.version = _zstd_dict_version
+    return _zstd_local
+
+
+def decompress_entry(data) -> bytes:
+    if data[:4] == ZSTD_MAGIC:
+        # ZstdDecompressor.decompress stops after the first frame, entries may hold several
+        dctx = _get_zstd_thread_state().dctx
+        return dctx.decompressobj(read_across_frames=True).decompress(data)
+    # lzma has no reusable decoder state: LZMADecompressor objects are single-stream
+    return lzma.decompress(data)
+
+
+# largest piece decoded at a time by get_file_into, bounds the temporary bytes lzma hands back
+DECOMPRESS_INTO_CHUNK_SIZE = 1024 * 1024
+
+
+def _lzma_decompress_into(data, out_view: memoryview) -> int:
+    written = 0
+    decoder = lzma.LZMADecompressor()
+    next_stream = False
+    while True:
+        # asking for one byte more than fits tells a too small buffer apart from an exact fit
+        max_length = min(len(out_view) - written + 1, DECOMPRESS_INTO_CHUNK_SIZE)
+        try:
+            chunk = decoder.decompress(data, max_length=max_length)
+        except lzma.LZMAError:
+            if not next_stream:
+                raise
+            # trailing data after a complete stream is not another stream, ignore it
+            # like lzma.decompress does
+            return written
+        data = b""
+        next_stream = False
+        if len(chunk) > len(out_view) - written:
+            raise ValueError(f"output buffer of {len(out_view)} bytes is too small for the entry")
+        out_view[written:written + len(chunk)] = chunk
+        written += len(chunk)
+        if decoder.eof:
+            # concatenated streams
+            data = decoder.unused_data
+            if not data:
+                return written
+            decoder = lzma.LZMADecompressor()
+            next_stream = True
+        elif decoder.needs_input:
+            raise lzma.LZMAError("Compressed data ended before the end-of-stream marker was reached")
+
+
+def _zstd_decompress_into(data, out_view: memoryview) -> int:
+    written = 0
+    dctx = _get_zstd_thread_state().dctx
+    with dctx.stream_reader(data, read_across_frames=True) as reader:
+        while written < len(out_view):
+            read_size = reader.readinto(out_view[written:])
+            if not read_size:
+                return written
+            written += read_size
+        if reader.read(1):
+            raise ValueError(f"output buffer of {len(out_view)} bytes is too small for the entry")
+    return written
+
+
+def _copy_into(data: bytes, out) -> int:
+    if len(data) > len(out):
+        raise ValueError(f"output buffer of {len(out)} bytes is too small for the entry")
+    out[:len(data)] = data
+    return len(data)
+
+
+def decompress_entry_into(data, out) -> int:
+    with memoryview(out) as out_view:
+        if data[:4] == ZSTD_MAGIC:
+            return _zstd_decompress_into(data, out_view)
+        return _lzma_decompress_into(data, out_view)
+
+
+@dataclass(slots=True)
 class S4AEntryMetadata:
     name: str
     _type: str
     offset: int
     size: int
+    # not recorded by archives from older compressors
+    uncompressed_size: Optional[int] = None
+
+
+# mmap_size and cache_size only help file-backed indexes, not ones deserialized from S3
+S4A_DB_PRAGMAS = (
+    "PRAGMA query_only=1",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def _connect_s4a_db(database, uri: bool = False):
+    # local readers keep the connection around, it may be used from their worker threads
+    return sqlite3.connect(database, uri=uri, isolation_level=None, check_same_thread=False)
+
+
+def _read_entry_map(conn: sqlite3.Connection):
+    for pragma in S4A_DB_PRAGMAS:
+        conn.execute(pragma)
+    cur = conn.cursor()
+    # no ORDER BY: the compressor inserts rows in blob order already, and sorting in sqlite costs
+    # a noticeable part of the open. bulk readers sort by offset themselves, which is cheap on
+    # nearly sorted input
+    try:
+        cur.execute("SELECT name, type, offset, size, uncompressed_size FROM entry_list")
+    except sqlite3.OperationalError:
+        cur.execute("SELECT name, type, offset, size FROM entry_list")
+    return {x[0]: S4AEntryMetadata(*x) for x in cur}
 
 
 def parse_s4a_db(db_file):
+    # read-only, so a wrong path fails instead of leaving an empty db behind
     try:
-        conn = sqlite3.Connection(db_file)
-        cur = conn.cursor()
-        res_iter = cur.execute("SELECT name, type, offset, size FROM entry_list")
-        entry_list = res_iter.fetchall()
-        return {x[0]: S4AEntryMetadata(x[0], x[1], x[2], x[3]) for x in entry_list}
-    except Exception as e:
-        print(f"error parsing s4a db: {e}")
+        conn = _connect_s4a_db(Path(os.path.abspath(db_file)).as_uri() + "?mode=ro", uri=True)
+    except Exception:
+        logger.exception("error parsing s4a db")
         return None
+    try:
+        return conn, _read_entry_map(conn)
+    except Exception:
+        conn.close()
+        logger.exception("error parsing s4a db")
+        return None
+
+
+def parse_s4a_db_bytes(db_data: bytes):
+    # only the entry map is returned: the in-memory db is a second full copy of the index,
+    # keeping it open would pin that for the reader's whole life
+    try:
+        conn = _connect_s4a_db(":memory:")
+    except Exception:
+        logger.exception("error parsing s4a db")
+        return None
+    try:
+        if hasattr(conn, "deserialize"):
+            conn.deserialize(db_data)
+        else:
+            # sqlite can open the db straight from memory from python 3.11, older ones need a file
+            import tempfile
+            with tempfile.NamedTemporaryFile(suffix=".s4a.db", delete=False) as temp_file:
+                temp_file.write(db_data)
+            try:
+                file_conn = sqlite3.connect(temp_file.name)
+                try:
+                    file_conn.backup(conn)
+                finally:
+                    file_conn.close()
+            finally:
+                os.remove(temp_file.name)
+        return _read_entry_map(conn)
+    except Exception:
+        logger.exception("error parsing s4a db")
+        return None
+    finally:
+        conn.close()
 
 
 @dataclass
-class S4AReaderS3:
+class S4AEntryCache:
+    # LRU of decompressed entries, bounded by total size of the cached data
+    max_bytes: int
+    _entries: OrderedDict[str, bytes] = field(default_factory=OrderedDict, init=False, repr=False)
+    _size: int = field(default=0, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def get(self, name: str):
+        with self._lock:
+            data = self._entries.get(name)
+            if data is not None:
+                self._entries.move_to_end(name)
+            return data
+
+    def put(self, name: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old_data = self._entries.pop(name, None)
+            if old_data is not None:
+                self._size -= len(old_data)
+            self._entries[name] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted_data = self._entries.popitem(last=False)
+                self._size -= len(evicted_data)
+
+
+def iter_sorted_prefix(
+    sorted_names: list[str], entry_map: dict[str, S4AEntryMetadata], prefix: str
+):
+    for name in islice(sorted_names, bisect.bisect_left(sorted_names, prefix), None):
+        if not name.startswith(prefix):
+            break
+        yield entry_map[name]
+
+
+def coalesce_entries(entries: list[S4AEntryMetadata], max_gap: int):
+    groups: list[list[S4AEntryMetadata]] = []
+    group_end = 0
+    for entry_info in sorted(entries, key=lambda x: x.offset):
+        if groups and entry_info.offset - group_end < max_gap:
+            groups[-1].append(entry_info)
+        else:
+            groups.append([entry_info])
+        group_end = max(group_end, entry_info.offset + entry_info.size)
+    return groups
+
+
+@dataclass
+class _S4AReaderBase:
+    # cache, prefix index and teardown shared by the readers, entry_map is declared by each reader
+    # decompressed entries are kept up to this many bytes, 0 disables caching
+    max_cache_bytes: int = field(default=64 * 1024 * 1024, kw_only=True)
+    _cache: S4AEntryCache = field(init=False, repr=False)
+    _sorted_names: Optional[list[str]] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self._cache = S4AEntryCache(self.max_cache_bytes)
+
+    def iter_prefix(self, prefix: str):
+        # names are only sorted on first use, most readers never need it
+        if self._sorted_names is None:
+            self._sorted_names = sorted(self.entry_map)
+        return iter_sorted_prefix(self._sorted_names, self.entry_map, prefix)
+
+    def close(self):
+        # readers holding pools, maps or connections release them here
+        pass
+
+    def __del__(self):
+        self.close()
+
+
+@dataclass
+class S4AReaderS3(_S4AReaderBase):
     s3_client: Any
     bucket_name: str
     blob_key_name: str
     entry_map: dict[str, S4AEntryMetadata]
+    # entries bigger than parallel_chunk_size are fetched as concurrent byte-range GETs.
+    # the s3 client should allow at least `parallelism` pooled connections
+    # (see make_s4a_s3_client) for this to help
+    parallel_chunk_size: int = 8 * 1024 * 1024
+    parallelism: int = 8
+    # get_files merges entries less than coalesce_gap bytes apart into a single GET
+    coalesce_gap: int = 1024 * 1024
+    _executor: ThreadPoolExecutor = field(init=False, repr=False)
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._executor = ThreadPoolExecutor(max_workers=self.parallelism)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
 
-    def get_file(self, name: str):
-        if name in self.entry_map:
-            entry_info = self.entry_map[name]
+    def _get_range_into(self, start: int, end: int, buf: memoryview):
+        s3_get_resp = self.s3_client.get_object(
+            Bucket=self.bucket_name,
+            Key=self.blob_key_name,
+            Range=f"bytes={start}-{end}"
+        )
+        body = s3_get_resp['Body']
+        # a failed read would otherwise keep the pooled connection busy
+        try:
+            read_size = 0
+            while read_size < len(buf):
+                chunk = body.read(min(len(buf) - read_size, 1024 * 1024))
+                if not chunk:
+                    raise IOError(f"short read for bytes={start}-{end}: got {read_size} bytes")
+                buf[read_size:read_size + len(chunk)] = chunk
+                read_size += len(chunk)
+        finally:
+            body.close()
+
+    def _submit_range(self, offset: int, size: int):
+        data = bytearray(size)
+        data_view = memoryview(data)
+        end = offset + size - 1
+        chunk_size = self.parallel_chunk_size
+        futures = [
+            self._executor.submit(
+                self._get_range_into,
+                offset + i,
+                min(offset + i + chunk_size - 1, end),
+                data_view[i:i + chunk_size]
+            )
+            for i in range(0, size, chunk_size)
+        ]
+        return data, futures
+
+    def _get_compressed_data(self, entry_info: S4AEntryMetadata):
+        if entry_info.size <= self.parallel_chunk_size:
+            s3_get_resp = self.s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=self.blob_key_name,
+                Range=f"bytes={entry_info.offset}-{entry_info.offset + entry_info.size - 1}"
+            )
+            return s3_get_resp['Body'].read()
+        compressed_data, futures = self._submit_range(entry_info.offset, entry_info.size)
+        for future in futures:
+            future.result()
+        return compressed_data
+
+    def _get_file(self, name: str) -> Optional[bytes]:
+        entry_info = self.entry_map.get(name)
+        if entry_info is None:
+            return None
+        uncompressed_data = self._cache.get(name)
+        if uncompressed_data is None:
+            uncompressed_data = decompress_entry(self._get_compressed_data(entry_info))
+            self._cache.put(name, uncompressed_data)
+        return uncompressed_data
+
+    def get_file(self, name: str) -> Optional[bytes]:
+        try:
+            return self._get_file(name)
+        except Exception:
+            logger.exception("error getting %s from blob", name)
+            return None
+
+    def get_file_into(self, name: str, out: bytearray) -> Optional[int]:
+        # decompresses straight into out (sized from entry_map[name].uncompressed_size),
+        # returns the number of bytes written
+        try:
+            entry_info = self.entry_map.get(name)
+            if entry_info is None:
+                return None
+            cached_data = self._cache.get(name)
+            if cached_data is not None:
+                return _copy_into(cached_data, out)
+            return decompress_entry_into(self._get_compressed_data(entry_info), out)
+        except Exception:
+            logger.exception("error getting %s from blob", name)
+            return None
+
+    def get_files(self, names: list[str]) -> dict[str, Optional[bytes]]:
+        # entries close to each other in the blob are fetched with one ranged GET, groups are
+        # fetched in parallel and entries are decompressed on the same pool as their group lands
+        file_map = {name: self._cache.get(name) for name in names}
+        entries = [
+            self.entry_map[name] for name, data in file_map.items()
+            if data is None and name in self.entry_map and self.entry_map[name]._type == "FILE"
+        ]
+        group_fetches = []
+        for group in coalesce_entries(entries, self.coalesce_gap):
+            group_offset = group[0].offset
+            group_size = max(x.offset + x.size for x in group) - group_offset
+            group_data, futures = self._submit_range(group_offset, group_size)
+            group_fetches.append((group, group_offset, group_data, futures))
+        decompress_futures = []
+        for group, group_offset, group_data, futures in group_fetches:
             try:
-                s3_get_resp = self.s3_client.get_object(
-                    Bucket=self.bucket_name,
-                    Key=self.blob_key_name,
-                    Range=f"bytes={entry_info.offset}-{entry_info.offset + entry_info.size - 1}"
+                for future in futures:
+                    future.result()
+            except Exception:
+                logger.exception("error getting %d files from blob", len(group))
+                continue
+            group_view = memoryview(group_data)
+            for entry_info in group:
+                start = entry_info.offset - group_offset
+                entry_data = group_view[start:start + entry_info.size]
+                decompress_futures.append(
+                    (entry_info.name, self._executor.submit(decompress_entry, entry_data))
                 )
-                s3_object_data = s3_get_resp['Body'].read()
-            except Exception as e:
-                print(f"error getting file from blob: {e}")
-                return None
+        for name, future in decompress_futures:
             try:
-                uncompressed_data = lzma.decompress(s3_object_data)
-            except Exception as e:
-                print(f"error un-compressing data: {e}")
-                return None
-            return uncompressed_data
+                file_map[name] = future.result()
+            except Exception:
+                logger.exception("error un-compressing %s", name)
+                continue
+            self._cache.put(name, file_map[name])
+        return file_map
+
+
+def make_s4a_s3_client(max_pool_connections: int = 64):
+    # one client is shared by all of a reader's threads, so the pool has to cover the fan-out.
+    # boto3 1.34 only validates GET checksums when asked to, nothing to turn off there
+    import boto3
+    from botocore.config import Config
+    return boto3.client("s3", config=Config(
+        max_pool_connections=max_pool_connections,
+        retries={"mode": "standard", "max_attempts": 3},
+        tcp_keepalive=True,
+        s3={"addressing_style": "virtual", "us_east_1_regional_endpoint": "regional"}
+    ))
 
 
 def make_s4a_reader_s3(s3_client: Any, bucket_name: str, object_name: str):
+    # pass s3_client=None to use a client from make_s4a_s3_client
+    if s3_client is None:
+        try:
+            s3_client = make_s4a_s3_client()
+        except Exception:
+            logger.exception("error creating s3 client")
+            return None
     try:
         s3_get_resp = s3_client.get_object(Bucket=bucket_name, Key=object_name)
         s3_object_data = s3_get_resp['Body'].read()
-    except Exception as e:
-        print(f"ERROR reading {object_name} in {bucket_name} from S3: {e}")
+    except Exception:
+        logger.exception("error reading %s in %s from S3", object_name, bucket_name)
+        return None
+    entry_map = parse_s4a_db_bytes(s3_object_data)
+    if entry_map is None:
         return None
-    temp_file = tempfile.NamedTemporaryFile()
-    temp_file.write(s3_object_data)
+    return S4AReaderS3(
+        s3_client,
+        bucket_name,
+        object_name.replace(".s4a.db", ".s4a.blob"),
+        entry_map
+    )
+
+
+@dataclass
+class S4AReaderS3Async(_S4AReaderBase):
+    # same as S4AReaderS3, but takes an aiobotocore s3 client
+    # (`async with aiobotocore.session.get_session().create_client("s3") as s3_client:`)
+    s3_client: Any
+    bucket_name: str
+    blob_key_name: str
+    entry_map: dict[str, S4AEntryMetadata]
+    # max number of GETs get_files keeps in flight
+    parallelism: int = 64
+    # get_files merges entries less than coalesce_gap bytes apart into a single GET
+    coalesce_gap: int = 1024 * 1024
+
+    async def _get_range(self, offset: int, size: int):
+        s3_get_resp = await self.s3_client.get_object(
+            Bucket=self.bucket_name,
+            Key=self.blob_key_name,
+            Range=f"bytes={offset}-{offset + size - 1}"
+        )
+        return await s3_get_resp['Body'].read()
+
+    async def _get_file(self, name: str) -> Optional[bytes]:
+        # asyncio is imported where it's used, sync users shouldn't pay for it at import time.
+        # any caller here already runs an event loop, so it is loaded by then
+        import asyncio
+        entry_info = self.entry_map.get(name)
+        if entry_info is None:
+            return None
+        uncompressed_data = self._cache.get(name)
+        if uncompressed_data is None:
+            s3_object_data = await self._get_range(entry_info.offset, entry_info.size)
+            # decoding is cpu bound, keep it off the event loop
+            uncompressed_data = await asyncio.to_thread(decompress_entry, s3_object_data)
+            self._cache.put(name, uncompressed_data)
+        return uncompressed_data
+
+    async def get_file(self, name: str) -> Optional[bytes]:
+        try:
+            return await self._get_file(name)
+        except Exception:
+            logger.exception("error getting %s from blob", name)
+            return None
+
+    async def get_files(self, names: list[str]) -> dict[str, Optional[bytes]]:
+        import asyncio
+        file_map = {name: self._cache.get(name) for name in names}
+        entries = [
+            self.entry_map[name] for name, data in file_map.items()
+            if data is None and name in self.entry_map and self.entry_map[name]._type == "FILE"
+        ]
+        semaphore = asyncio.Semaphore(self.parallelism)
+
+        async def get_group(group: list[S4AEntryMetadata]):
+            group_offset = group[0].offset
+            group_size = max(x.offset + x.size for x in group) - group_offset
+            try:
+                async with semaphore:
+                    group_data = await self._get_range(group_offset, group_size)
+            except Exception:
+                logger.exception("error getting %d files from blob", len(group))
+                return
+            group_view = memoryview(group_data)
+            for entry_info in group:
+                start = entry_info.offset - group_offset
+                entry_data = group_view[start:start + entry_info.size]
+                try:
+                    uncompressed_data = await asyncio.to_thread(decompress_entry, entry_data)
+                except Exception:
+                    logger.exception("error un-compressing %s", entry_info.name)
+                    continue
+                file_map[entry_info.name] = uncompressed_data
+                self._cache.put(entry_info.name, uncompressed_data)
+
+        await asyncio.gather(*(get_group(x) for x in coalesce_entries(entries, self.coalesce_gap)))
+        return file_map
+
+
+async def make_s4a_reader_s3_async(s3_client: Any, bucket_name: str, object_name: str):
+    import asyncio
     try:
-        entry_map = parse_s4a_db(temp_file.name)
-    except Exception as e:
-        print(f"error parsing .s4a.db: {e}")
+        s3_get_resp = await s3_client.get_object(Bucket=bucket_name, Key=object_name)
+        s3_object_data = await s3_get_resp['Body'].read()
+    except Exception:
+        logger.exception("error reading %s in %s from S3", object_name, bucket_name)
         return None
-    return S4AReaderS3(s3_client, bucket_name, object_name.replace(".s4a.db", ".s4a.blob"), entry_map)
+    entry_map = await asyncio.to_thread(parse_s4a_db_bytes, s3_object_data)
+    if entry_map is None:
+        return None
+    return S4AReaderS3Async(
+        s3_client,
+        bucket_name,
+        object_name.replace(".s4a.db", ".s4a.blob"),
+        entry_map
+    )
 
 
 @dataclass
-class S4AReaderLocal:
+class S4AReaderLocal(_S4AReaderBase):
     blob_path: str
     entry_map: dict[str, S4AEntryMetadata]
+    blob_mmap: Optional[mmap.mmap] = None
+    # read-only connection to the file-backed index, closed with the reader
+    db_conn: Optional[sqlite3.Connection] = field(default=None, repr=False)
 
-    def get_file(self, name: str):
-        if name in self.entry_map:
-            entry_info = self.entry_map[name]
-            try:
-                with open(self.blob_path, 'rb') as fr:
-                    fr.seek(entry_info.offset)
-                    compressed_data = fr.read(entry_info.size)
-            except Exception as e:
-                print(f"error getting file from blob: {e}")
-                return None
-            try:
-                uncompressed_data = lzma.decompress(compressed_data)
-            except Exception as e:
-                print(f"error un-compressing data: {e}")
+    def __post_init__(self):
+        super().__post_init__()
+        # readers built straight from blob_path and entry_map map the blob here.
+        # it stays None only for an empty blob
+        if self.blob_mmap is None:
+            self.blob_mmap = mmap_s4a_blob(self.blob_path)
+
+    def close(self):
+        if self.blob_mmap is not None:
+            self.blob_mmap.close()
+            self.blob_mmap = None
+        if self.db_conn is not None:
+            self.db_conn.close()
+            self.db_conn = None
+
+    def _get_entry_view(self, entry_info: S4AEntryMetadata):
+        if self.blob_mmap is None:
+            raise ValueError(f"{self.blob_path} is not mapped (empty blob or closed reader)")
+        end = entry_info.offset + entry_info.size
+        if end > len(self.blob_mmap):
+            raise ValueError(f"{entry_info.name} is outside of {self.blob_path}")
+        return memoryview(self.blob_mmap)[entry_info.offset:end]
+
+    def _get_file(self, name: str) -> Optional[bytes]:
+        entry_info = self.entry_map.get(name)
+        if entry_info is None:
+            return None
+        uncompressed_data = self._cache.get(name)
+        if uncompressed_data is None:
+            with self._get_entry_view(entry_info) as compressed_data:
+                uncompressed_data = decompress_entry(compressed_data)
+            self._cache.put(name, uncompressed_data)
+        return uncompressed_data
+
+    def get_file(self, name: str) -> Optional[bytes]:
+        try:
+            return self._get_file(name)
+        except Exception:
+            logger.exception("error getting %s from blob", name)
+            return None
+
+    def get_file_into(self, name: str, out: bytearray) -> Optional[int]:
+        # decompresses straight into out (sized from entry_map[name].uncompressed_size),
+        # returns the number of bytes written
+        try:
+            entry_info = self.entry_map.get(name)
+            if entry_info is None:
                 return None
-            return uncompressed_data
+            cached_data = self._cache.get(name)
+            if cached_data is not None:
+                return _copy_into(cached_data, out)
+            with self._get_entry_view(entry_info) as compressed_data:
+                return decompress_entry_into(compressed_data, out)
+        except Exception:
+            logger.exception("error getting %s from blob", name)
+            return None
 
+    def get_files(self, names: list[str]) -> dict[str, Optional[bytes]]:
+        # the blob is mapped, so walking the entries in blob order is all coalescing needs
+        file_map = {name: None for name in names}
+        entries = [
+            self.entry_map[name] for name in file_map
+            if name in self.entry_map and self.entry_map[name]._type == "FILE"
+        ]
+        for entry_info in sorted(entries, key=lambda x: x.offset):
+            file_map[entry_info.name] = self.get_file(entry_info.name)
+        return file_map
 
-def make_s4a_reader_local(db_path: str):
+    def extract_all(self, out_dir: str, workers: Optional[int] = None):
+        # worker processes map the blob themselves, only offsets and sizes are sent to them
+        out_root = os.path.abspath(out_dir)
+        jobs = []
+        for entry_info in sorted(self.entry_map.values(), key=lambda x: x.offset):
+            out_path = os.path.abspath(os.path.join(out_root, entry_info.name))
+            if os.path.commonpath([out_root, out_path]) != out_root:
+                logger.warning("%s points outside of %s. skipping", entry_info.name, out_dir)
+                continue
+            if entry_info._type == "FOLDER":
+                os.makedirs(out_path, exist_ok=True)
+            elif entry_info._type == "FILE":
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                jobs.append((entry_info.name, entry_info.offset, entry_info.size, out_path))
+            else:
+                logger.warning(
+                    "invalid entry type \"%s\" for %s. skipping", entry_info._type, entry_info.name
+                )
+        if not jobs:
+            return 0
+        # multiprocessing is slow to import and only needed here
+        from concurrent.futures import ProcessPoolExecutor
+        extracted = 0
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_extract_worker,
+            initargs=(self.blob_path, _zstd_dict_data)
+        ) as pool:
+            for name, error in pool.map(_extract_entry, jobs, chunksize=64):
+                if error is None:
+                    extracted += 1
+                else:
+                    logger.error("error extracting %s: %s. skipping", name, error)
+        return extracted
+
+
+def mmap_s4a_blob(blob_path: str, sequential: bool = False):
+    # empty archives have an empty blob, which can't be mapped
+    if os.path.getsize(blob_path) == 0:
+        return None
+    with open(blob_path, 'rb') as fr:
+        blob_mmap = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+    # readers jump between entries, bulk extraction walks the blob front to back
+    advice = "MADV_SEQUENTIAL" if sequential else "MADV_RANDOM"
+    if hasattr(blob_mmap, "madvise") and hasattr(mmap, advice):
+        blob_mmap.madvise(getattr(mmap, advice))
+    return blob_mmap
+
+
+_worker_blob_mmap: Optional[mmap.mmap] = None
+
+
+def _init_extract_worker(blob_path: str, zstd_dict_data: Optional[bytes]):
+    global _worker_blob_mmap
+    _worker_blob_mmap = mmap_s4a_blob(blob_path, sequential=True)
+    set_zstd_dictionary(zstd_dict_data)
+
+
+def _extract_entry(job: tuple[str, int, int, str]):
+    name, offset, size, out_path = job
     try:
-        entry_map = parse_s4a_db(db_path)
+        with memoryview(_worker_blob_mmap)[offset:offset + size] as compressed_data:
+            uncompressed_data = decompress_entry(compressed_data)
+        with open(out_path, 'wb') as fw:
+            fw.write(uncompressed_data)
     except Exception as e:
-        print(f"error parsing .s4a.db: {e}")
+        return name, str(e)
+    return name, None
+
+
+def make_s4a_reader_local(db_path: str):
+    parsed_db = parse_s4a_db(db_path)
+    if parsed_db is None:
+        return None
+    db_conn, entry_map = parsed_db
+    blob_path = db_path.replace(".s4a.db", ".s4a.blob")
+    try:
+        return S4AReaderLocal(blob_path, entry_map, db_conn=db_conn)
+    except Exception:
+        db_conn.close()
+        logger.exception("error mapping %s", blob_path)
         return None
-    return S4AReaderLocal(db_path.replace(".s4a.db", ".s4a.blob"), entry_map)
@@ -0,0 +1,406 @@
+import asyncio
+import io
+import lzma
+import os
+import random
+import sqlite3
+
+import pytest
+
+import s4_reader
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RAW = random.Random(0).randbytes(300_000)
+PARTS = [RAW[:100_000], RAW[100_000:250_000], RAW[250_000:]]
+
+
+def multi_stream_xz(parts):
+    return b"".join(lzma.compress(part, preset=0) for part in parts)
+
+
+def multi_frame_zstd(parts):
+    return b"".join(zstandard.ZstdCompressor().compress(part) for part in parts)
+
+
+@pytest.mark.parametrize("data", [
+    lzma.compress(RAW, preset=0),
+    multi_stream_xz(PARTS),
+    multi_stream_xz(PARTS) + b"trailing garbage",
+])
+def test_decompress_entry_xz(data):
+    assert s4_reader.decompress_entry(data) == lzma.decompress(data) == RAW
+
+
+@pytest.mark.skipif(zstandard is None, reason="zstandard is not installed")
+def test_decompress_entry_zstd_frames():
+    assert s4_reader.decompress_entry(multi_frame_zstd(PARTS)) == RAW
+
+
+def make_archive(prefix, entries):
+    # entries maps names to already compressed data
+    blob = bytearray()
+    conn = sqlite3.connect(prefix + ".s4a.db")
+    conn.execute(
+        "CREATE TABLE entry_list"
+        " (name VARCHAR(2048), type VARCHAR(8), offset BIGINT, size BIGINT, uncompressed_size BIGINT)"
+    )
+    conn.execute("INSERT INTO entry_list VALUES ('d', 'FOLDER', 0, 0, 0)")
+    for name, data in entries.items():
+        conn.execute(
+            "INSERT INTO entry_list VALUES (?, 'FILE', ?, ?, ?)",
+            (name, len(blob), len(data), len(s4_reader.decompress_entry(data)))
+        )
+        blob += data
+    conn.commit()
+    conn.close()
+    with open(prefix + ".s4a.blob", "wb") as fw:
+        fw.write(blob)
+    return prefix + ".s4a.db"
+
+
+class FakeS3:
+    def __init__(self, root: str):
+        self.root = root
+        self.ranges = []
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Range:
+            self.ranges.append(Range)
+        with open(os.path.join(self.root, Key), "rb") as fr:
+            data = fr.read()
+        if Range:
+            start, end = Range[len("bytes="):].split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": io.BytesIO(data)}
+
+
+def archive_entries():
+    entries = {
+        "d/one.xz": lzma.compress(RAW, preset=0),
+        "d/streams.xz": multi_stream_xz(PARTS),
+        "d/trailing.xz": multi_stream_xz(PARTS) + b"trailing garbage",
+        "d/empty.xz": lzma.compress(b""),
+    }
+    if zstandard is not None:
+        entries["d/frames.zst"] = multi_frame_zstd(PARTS)
+    return entries
+
+
+@pytest.fixture(params=["local", "s3", "s3-ranged"])
+def reader(request, tmp_path):
+    make_archive(str(tmp_path / "a"), archive_entries())
+    if request.param == "local":
+        s4_reader_obj = s4_reader.make_s4a_reader_local(str(tmp_path / "a.s4a.db"))
+    else:
+        s4_reader_obj = s4_reader.make_s4a_reader_s3(FakeS3(str(tmp_path)), "bucket", "a.s4a.db")
+    if request.param == "s3-ranged":
+        # small chunks so big entries go through the parallel range reads too
+        s4_reader_obj.parallel_chunk_size = 64 * 1024
+    yield s4_reader_obj
+    s4_reader_obj.close()
+
+
+def test_get_file_variants_agree(reader):
+    names = [x for x in reader.entry_map if reader.entry_map[x]._type == "FILE"]
+    files = reader.get_files(names)
+    for name in names:
+        expected = b"" if name == "d/empty.xz" else RAW
+        assert reader.get_file(name) == expected, name
+        assert files[name] == expected, name
+        out = bytearray(reader.entry_map[name].uncompressed_size)
+        assert reader.get_file_into(name, out) == len(expected), name
+        assert out == expected, name
+
+
+def test_get_file_into_uncached(reader):
+    for name in reader.entry_map:
+        if reader.entry_map[name]._type != "FILE":
+            continue
+        out = bytearray(reader.entry_map[name].uncompressed_size)
+        assert reader.get_file_into(name, out) == len(out), name
+        assert reader.get_file(name) == bytes(out), name
+
+
+def test_get_file_into_small_buffer(reader):
+    assert reader.get_file_into("d/streams.xz", bytearray(len(RAW) - 1)) is None
+    assert reader.get_file_into("missing", bytearray(10)) is None
+
+
+def test_extract_all(tmp_path):
+    reader = s4_reader.make_s4a_reader_local(make_archive(str(tmp_path / "a"), archive_entries()))
+    file_names = [x for x in reader.entry_map if reader.entry_map[x]._type == "FILE"]
+    assert reader.extract_all(str(tmp_path / "out"), workers=2) == len(file_names)
+    for name in file_names:
+        with open(tmp_path / "out" / name, "rb") as fr:
+            assert fr.read() == reader.get_file(name)
+    reader.close()
+
+
+class ShortReadS3(FakeS3):
+    # drops the last byte of every ranged GET and keeps the bodies it handed out
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.bodies = []
+
+    def get_object(self, Bucket, Key, Range=None):
+        resp = super().get_object(Bucket, Key, Range)
+        if Range:
+            resp["Body"] = io.BytesIO(resp["Body"].read()[:-1])
+            self.bodies.append(resp["Body"])
+        return resp
+
+
+def test_range_bodies_closed_on_short_read(tmp_path):
+    make_archive(str(tmp_path / "a"), archive_entries())
+    s3_client = ShortReadS3(str(tmp_path))
+    reader = s4_reader.make_s4a_reader_s3(s3_client, "bucket", "a.s4a.db")
+    reader.parallel_chunk_size = 64 * 1024
+    assert reader.get_file("d/one.xz") is None
+    assert s3_client.bodies and all(x.closed for x in s3_client.bodies)
+    reader.close()
+
+
+def test_local_reader_from_entry_map(tmp_path):
+    # the plain constructor maps the blob itself, like make_s4a_reader_local does
+    db_path = make_archive(str(tmp_path / "a"), archive_entries())
+    db_conn, entry_map = s4_reader.parse_s4a_db(db_path)
+    db_conn.close()
+    reader = s4_reader.S4AReaderLocal(str(tmp_path / "a.s4a.blob"), entry_map)
+    assert reader.get_file("d/one.xz") == RAW
+    out = bytearray(len(RAW))
+    assert reader.get_file_into("d/streams.xz", out) == len(RAW)
+    reader.close()
+    assert reader.get_file("d/streams.xz") is None
+
+
+class NoDeserializeConnection(sqlite3.Connection):
+    # looks like a connection from a python without Connection.deserialize
+    @property
+    def deserialize(self):
+        raise AttributeError("deserialize")
+
+
+@pytest.mark.parametrize("deserialize", [True, False])
+def test_parse_s4a_db_bytes(monkeypatch, tmp_path, deserialize):
+    db_path = make_archive(str(tmp_path / "a"), archive_entries())
+    db_conn, entry_map = s4_reader.parse_s4a_db(db_path)
+    db_conn.close()
+    if not deserialize:
+        monkeypatch.setattr(s4_reader, "_connect_s4a_db", lambda database, **kwargs: sqlite3.connect(
+            database, factory=NoDeserializeConnection, isolation_level=None, check_same_thread=False
+        ))
+    with open(db_path, "rb") as fr:
+        parsed_db = s4_reader.parse_s4a_db_bytes(fr.read())
+    assert parsed_db == entry_map
+    assert s4_reader.parse_s4a_db_bytes(b"not a sqlite db") is None
+
+
+def test_coalesce_entries():
+    def entry(name, offset, size):
+        return s4_reader.S4AEntryMetadata(name, "FILE", offset, size)
+
+    entries = [entry("c", 100, 1), entry("a", 0, 10), entry("d", 101, 0), entry("b", 15, 5)]
+    groups = s4_reader.coalesce_entries(entries, 10)
+    assert [[x.name for x in group] for group in groups] == [["a", "b"], ["c", "d"]]
+    # the gap has to be strictly smaller than max_gap
+    groups = s4_reader.coalesce_entries(entries, 5)
+    assert [[x.name for x in group] for group in groups] == [["a"], ["b"], ["c", "d"]]
+    # an entry inside an earlier, bigger one doesn't pull the group end back
+    groups = s4_reader.coalesce_entries([entry("a", 0, 100), entry("b", 10, 5), entry("c", 105, 1)], 10)
+    assert [[x.name for x in group] for group in groups] == [["a", "b", "c"]]
+    assert s4_reader.coalesce_entries([], 10) == []
+
+
+@pytest.mark.parametrize("coalesce_gap, expected_gets", [(1024 * 1024, 1), (0, None)])
+def test_get_files_coalesces_ranges(tmp_path, coalesce_gap, expected_gets):
+    make_archive(str(tmp_path / "a"), archive_entries())
+    s3_client = FakeS3(str(tmp_path))
+    reader = s4_reader.make_s4a_reader_s3(s3_client, "bucket", "a.s4a.db")
+    reader.coalesce_gap = coalesce_gap
+    file_names = [x for x in reader.entry_map if reader.entry_map[x]._type == "FILE"]
+    files = reader.get_files(file_names)
+    assert all(files[x] is not None for x in file_names)
+    assert len(s3_client.ranges) == (expected_gets or len(file_names))
+    reader.close()
+
+
+def test_parse_s4a_db_missing_file(tmp_path):
+    # the index is opened read-only, a wrong path must not create an empty db
+    db_path = str(tmp_path / "missing.s4a.db")
+    assert s4_reader.make_s4a_reader_local(db_path) is None
+    assert not os.path.exists(db_path)
+
+
+def test_parse_s4a_db_read_only(tmp_path):
+    db_conn, entry_map = s4_reader.parse_s4a_db(make_archive(str(tmp_path / "a"), archive_entries()))
+    with pytest.raises(sqlite3.OperationalError):
+        db_conn.execute("DELETE FROM entry_list")
+    db_conn.close()
+
+
+def test_entry_cache_lru():
+    cache = s4_reader.S4AEntryCache(10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    # a was used last, so b is evicted to make room for c
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa" and cache.get("c") == b"cccc"
+    # replacing an entry doesn't count its old size twice
+    cache.put("a", b"aa")
+    cache.put("d", b"dddd")
+    assert [cache.get(x) for x in "acd"] == [b"aa", b"cccc", b"dddd"]
+    # entries bigger than the whole budget are never kept
+    cache.put("e", b"e" * 11)
+    assert cache.get("e") is None and cache.get("c") == b"cccc"
+
+
+def test_entry_cache_disabled():
+    cache = s4_reader.S4AEntryCache(0)
+    cache.put("a", b"a")
+    assert cache.get("a") is None
+
+
+@pytest.mark.parametrize("max_cache_bytes, expected_gets", [(64 * 1024 * 1024, 1), (0, 2)])
+def test_reader_cache(tmp_path, max_cache_bytes, expected_gets):
+    make_archive(str(tmp_path / "a"), archive_entries())
+    with open(tmp_path / "a.s4a.db", "rb") as fr:
+        entry_map = s4_reader.parse_s4a_db_bytes(fr.read())
+    s3_client = FakeS3(str(tmp_path))
+    reader = s4_reader.S4AReaderS3(
+        s3_client, "bucket", "a.s4a.blob", entry_map, max_cache_bytes=max_cache_bytes
+    )
+    assert reader.get_file("d/one.xz") == RAW
+    assert reader.get_file("d/one.xz") == RAW
+    assert len(s3_client.ranges) == expected_gets
+    reader.close()
+
+
+def test_iter_prefix(reader):
+    assert [x.name for x in reader.iter_prefix("d/")] == sorted(
+        x for x in reader.entry_map if x.startswith("d/")
+    )
+    # the folder itself sorts before its children
+    assert [x.name for x in reader.iter_prefix("d")][0] == "d"
+    assert [x.name for x in reader.iter_prefix("d/s")] == ["d/streams.xz"]
+    assert list(reader.iter_prefix("missing/")) == []
+    assert len(list(reader.iter_prefix(""))) == len(reader.entry_map)
+
+
+@pytest.mark.parametrize("reader_type", ["local", "s3", "s3-ranged"])
+def test_trailing_data_same_on_all_readers(tmp_path, reader_type):
+    # every reader decodes through decompress_entry(_into), so all of them follow the codec's
+    # rule: lzma ignores data after the last stream, zstandard rejects data after the last frame
+    entries = {"d/trailing.xz": (multi_stream_xz(PARTS) + b"trailing garbage", RAW)}
+    if zstandard is not None:
+        entries["d/trailing.zst"] = (multi_frame_zstd(PARTS) + b"trailing garbage", None)
+    entry_map = {}
+    blob = bytearray()
+    for name, (data, _) in entries.items():
+        entry_map[name] = s4_reader.S4AEntryMetadata(name, "FILE", len(blob), len(data), len(RAW))
+        blob += data
+    with open(tmp_path / "a.s4a.blob", "wb") as fw:
+        fw.write(blob)
+    if reader_type == "local":
+        reader = s4_reader.S4AReaderLocal(str(tmp_path / "a.s4a.blob"), entry_map)
+    else:
+        reader = s4_reader.S4AReaderS3(FakeS3(str(tmp_path)), "bucket", "a.s4a.blob", entry_map)
+    if reader_type == "s3-ranged":
+        reader.parallel_chunk_size = 64 * 1024
+    for name, (_, expected) in entries.items():
+        out = bytearray(len(RAW))
+        assert reader.get_file_into(name, out) == (None if expected is None else len(RAW)), name
+        assert reader.get_file(name) == expected, name
+        assert reader.get_files([name])[name] == expected, name
+    reader.close()
+
+
+def test_factories_return_none_on_bad_archives(tmp_path):
+    with open(tmp_path / "bad.s4a.db", "wb") as fw:
+        fw.write(b"not a sqlite db")
+    assert s4_reader.make_s4a_reader_local(str(tmp_path / "bad.s4a.db")) is None
+    assert s4_reader.make_s4a_reader_s3(FakeS3(str(tmp_path)), "bucket", "bad.s4a.db") is None
+    assert s4_reader.make_s4a_reader_s3(FakeS3(str(tmp_path)), "bucket", "missing.s4a.db") is None
+    # index without its blob
+    db_path = make_archive(str(tmp_path / "a"), archive_entries())
+    os.remove(tmp_path / "a.s4a.blob")
+    assert s4_reader.make_s4a_reader_local(db_path) is None
+
+
+class FakeAsyncS3(FakeS3):
+    # aiobotocore flavour: get_object and Body.read are coroutines
+    class Body:
+        def __init__(self, data: bytes):
+            self.data = data
+
+        async def read(self):
+            return self.data
+
+    async def get_object(self, Bucket, Key, Range=None):
+        resp = super().get_object(Bucket, Key, Range)
+        return {"Body": self.Body(resp["Body"].read())}
+
+
+def test_async_reader(tmp_path):
+    make_archive(str(tmp_path / "a"), archive_entries())
+    s3_client = FakeAsyncS3(str(tmp_path))
+
+    async def run():
+        reader = await s4_reader.make_s4a_reader_s3_async(s3_client, "bucket", "a.s4a.db")
+        file_names = [x for x in reader.entry_map if reader.entry_map[x]._type == "FILE"]
+        expected = {x: b"" if x == "d/empty.xz" else RAW for x in file_names}
+        assert await reader.get_files(file_names + ["missing"]) == {**expected, "missing": None}
+        # one coalesced GET for the whole blob, the rest is served from the cache
+        assert len(s3_client.ranges) == 1
+        assert await reader.get_file("d/streams.xz") == RAW
+        assert await reader.get_file("missing") is None
+        assert len(s3_client.ranges) == 1
+        assert [x.name for x in reader.iter_prefix("d/s")] == ["d/streams.xz"]
+        reader.close()
+
+        reader = await s4_reader.make_s4a_reader_s3_async(s3_client, "bucket", "a.s4a.db")
+        reader.coalesce_gap = 0
+        assert await reader.get_files(file_names) == expected
+        assert len(s3_client.ranges) == 1 + len(file_names)
+        reader.close()
+        assert await s4_reader.make_s4a_reader_s3_async(s3_client, "bucket", "missing.s4a.db") is None
+
+    asyncio.run(run())
+
+
+def test_async_reader_decode_errors(tmp_path):
+    entry_map = {"bad": s4_reader.S4AEntryMetadata("bad", "FILE", 0, 8)}
+    with open(tmp_path / "a.s4a.blob", "wb") as fw:
+        fw.write(b"not xz..")
+
+    async def run():
+        reader = s4_reader.S4AReaderS3Async(FakeAsyncS3(str(tmp_path)), "bucket", "a.s4a.blob", entry_map)
+        assert await reader.get_file("bad") is None
+        assert await reader.get_files(["bad"]) == {"bad": None}
+
+    asyncio.run(run())
+
+
+def test_old_archive_without_uncompressed_size(tmp_path):
+    # archives from older compressors have no uncompressed_size column
+    data = lzma.compress(RAW, preset=0)
+    conn = sqlite3.connect(tmp_path / "a.s4a.db")
+    conn.execute("CREATE TABLE entry_list (name VARCHAR(2048), type VARCHAR(8), offset BIGINT, size BIGINT)")
+    conn.execute("INSERT INTO entry_list VALUES ('one.xz', 'FILE', 0, ?)", (len(data),))
+    conn.commit()
+    conn.close()
+    with open(tmp_path / "a.s4a.blob", "wb") as fw:
+        fw.write(data)
+    reader = s4_reader.make_s4a_reader_local(str(tmp_path / "a.s4a.db"))
+    assert reader.entry_map["one.xz"] == s4_reader.S4AEntryMetadata("one.xz", "FILE", 0, len(data))
+    assert reader.entry_map["one.xz"].uncompressed_size is None
+    assert reader.get_file("one.xz") == RAW
+    # get_file_into still works when the caller knows the size some other way
+    out = bytearray(len(RAW))
+    assert reader.get_file_into("one.xz", out) == len(RAW) and out == RAW
+    reader.close()
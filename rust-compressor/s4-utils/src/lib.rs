@@ -20,6 +20,7 @@ enum WriteThreadData {
 struct WriteThreadInput {
   data: WriteThreadData,
   entry_name: String,
+  uncompressed_size: u64,
 }
 
 fn writer_loop(
@@ -44,14 +45,18 @@ fn writer_loop(
   // Create table
   conn
     .execute(
-      "CREATE TABLE entry_list (name VARCHAR(2048), type VARCHAR(8), offset BIGINT, size BIGINT)",
+      "CREATE TABLE entry_list \
+        (name VARCHAR(2048), type VARCHAR(8), offset BIGINT, size BIGINT, uncompressed_size BIGINT)",
       [],
     )
     .map_err(|e| format!("at creating mysql table: {e}"))?;
 
   // Prepare SQL insert statement
   let mut insert_row_stmt = conn
-    .prepare("INSERT INTO entry_list (name, type, offset, size) VALUES (?1, ?2, ?3, ?4)")
+    .prepare(
+      "INSERT INTO entry_list (name, type, offset, size, uncompressed_size) \
+        VALUES (?1, ?2, ?3, ?4, ?5)",
+    )
     .map_err(|e| format!("error preparing insert statement: {e}"))?;
 
   // Writer to output file
@@ -70,7 +75,7 @@ fn writer_loop(
             continue;
           }
           let _ = insert_row_stmt
-            .execute((&msg.entry_name, "FILE", offset, data.len() as u64))
+            .execute((&msg.entry_name, "FILE", offset, data.len() as u64, msg.uncompressed_size))
             .inspect_err(|e| eprintln!("error adding {} to index: {e}", &msg.entry_name));
           offset += data.len() as u64;
         }
@@ -88,13 +93,13 @@ fn writer_loop(
           let _ =
             fs::remove_file(&temp_file).inspect_err(|e| eprintln!("error removing temp file: {e}"));
           let _ = insert_row_stmt
-            .execute((&msg.entry_name, "FILE", offset, write_size))
+            .execute((&msg.entry_name, "FILE", offset, write_size, msg.uncompressed_size))
             .inspect_err(|e| eprintln!("error adding {} to index: {e}", &msg.entry_name));
           offset += write_size;
         }
         WriteThreadData::Folder => {
           let _ = insert_row_stmt
-            .execute((&msg.entry_name, "FOLDER", 0u64, 0u64))
+            .execute((&msg.entry_name, "FOLDER", 0u64, 0u64, 0u64))
             .inspect_err(|e| eprintln!("error adding {} to index: {e}", &msg.entry_name));
         }
       }
@@ -168,11 +173,12 @@ pub fn compress_directory(
           if file_len > max_in_mem_file_size {
             let _ = compress_utils::compress_lzma(entry.path(), &temp_file_path)
               .inspect_err(|e| eprintln!("error compressing {:?}: {e}", entry.path()))
-              .map(|_| {
+              .map(|uncompressed_size| {
                 let _ = tx_thread_owned
                   .send(Some(WriteThreadInput {
                     data: WriteThreadData::TempFile(temp_file_path),
                     entry_name,
+                    uncompressed_size,
                   }))
                   .inspect_err(|e| {
                     eprintln!("error writing {:?} to archive: {e}", entry.path());
@@ -181,11 +187,12 @@ pub fn compress_directory(
           } else {
             let _ = compress_utils::compress_lzma_in_mem(entry.path())
               .inspect_err(|e| eprintln!("error compressing {:?}: {e}", entry.path()))
-              .map(|data| {
+              .map(|(data, uncompressed_size)| {
                 let _ = tx_thread_owned
                   .send(Some(WriteThreadInput {
                     data: WriteThreadData::RawBytes(data),
                     entry_name,
+                    uncompressed_size,
                   }))
                   .inspect_err(|e| {
                     eprintln!("error writing {:?} to archive: {e}", entry.path());
@@ -195,7 +202,11 @@ pub fn compress_directory(
         });
       } else if entry.path().is_dir() {
         let _ = tx
-          .send(Some(WriteThreadInput { data: WriteThreadData::Folder, entry_name }))
+          .send(Some(WriteThreadInput {
+            data: WriteThreadData::Folder,
+            entry_name,
+            uncompressed_size: 0,
+          }))
           .inspect_err(|e| eprintln!("error writing {:?} to archive: {e}", entry.path()));
       }
     }